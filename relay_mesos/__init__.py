@@ -1,3 +1,6 @@
+import time as _time
+_start_time = _time.time()  # used to log how long startup takes
+
 import logging
 log = logging.getLogger('relay.mesos')
 
@@ -0,0 +1,117 @@
+"""
+Leader election, so several Relay.Mesos instances of the same framework can
+run side by side as hot standbys.
+
+Only the leader runs a mesos scheduler driver.  Standbys import everything
+the scheduler needs, run Relay so its state stays warm, and poll for
+leadership.  When the leader dies, a standby becomes leader and re-registers
+with the leader's framework id, so tasks keep running and Relay keeps
+scaling.
+
+Choose a backend with --mesos_ha_backend.  A backend subclasses
+LeaderElection.
+"""
+import errno
+import fcntl
+import os
+import time
+
+from relay_mesos import log
+
+
+class LeaderElection(object):
+    """
+    Interface for leader election backends
+
+    `lock` (str) identifies the election.  Given by --mesos_ha_lock
+    `ns` the Relay.Mesos argparse namespace
+    """
+    def __init__(self, lock, ns):
+        self.lock = lock
+        self.ns = ns
+
+    def try_acquire(self):
+        """
+        Try to become the leader without blocking.  Return True if this
+        instance is the leader.  Leadership must end when this process dies.
+        """
+        raise NotImplementedError()
+
+    def get_framework_id(self):
+        """Return the framework id the leader registered with, or None"""
+        raise NotImplementedError()
+
+    def set_framework_id(self, framework_id):
+        """Store the framework id the leader registered with"""
+        raise NotImplementedError()
+
+    def clear_framework_id(self):
+        """
+        Forget the stored framework id, ie. because mesos removed the
+        framework, so the next leader registers as a new framework
+        """
+        raise NotImplementedError()
+
+
+class FileLockElection(LeaderElection):
+    """
+    The instance holding an exclusive lock on the file at `lock` is the
+    leader.  The OS releases the lock when the leader dies.  The framework
+    id is stored next to the lock file.
+
+    All instances must share a filesystem that supports flock(2).
+    """
+    def __init__(self, lock, ns):
+        super(FileLockElection, self).__init__(lock, ns)
+        self.framework_id_path = lock + '.framework_id'
+        self._fd = None
+
+    def try_acquire(self):
+        if self._fd is None:
+            self._fd = os.open(self.lock, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as err:
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        return True
+
+    def get_framework_id(self):
+        try:
+            with open(self.framework_id_path) as fp:
+                return fp.read().strip() or None
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                return None
+            raise
+
+    def set_framework_id(self, framework_id):
+        tmp_path = self.framework_id_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            fp.write(framework_id)
+        os.rename(tmp_path, self.framework_id_path)
+
+    def clear_framework_id(self):
+        try:
+            os.remove(self.framework_id_path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
+def wait_for_leadership(election, poll_interval, mesos_framework_name):
+    """Block until this instance is the leader"""
+    if election.try_acquire():
+        return
+    log.info(
+        'Another instance is the leader.  Running as a hot standby',
+        extra=dict(
+            mesos_framework_name=mesos_framework_name,
+            mesos_ha_lock=election.lock))
+    while not election.try_acquire():
+        time.sleep(poll_interval)
+    log.info(
+        'This instance is now the leader', extra=dict(
+            mesos_framework_name=mesos_framework_name,
+            mesos_ha_lock=election.lock))
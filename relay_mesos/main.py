@@ -7,9 +7,11 @@ import time
 
 from relay import argparse_shared as at
 from relay.runner import main as relay_main, build_arg_parser as relay_ap
-from relay_mesos import log
-from relay_mesos.util import catch
-from relay_mesos.scheduler import Scheduler
+from relay.util import load_obj_from_path
+import relay_mesos
+from relay_mesos import log, metrics
+from relay_mesos.util import catch, SCALAR_KEYS
+from relay_mesos.ha import wait_for_leadership
 
 
 def warmer_cooler_wrapper(MV, ns):
@@ -82,6 +84,8 @@ def main(ns):
     filled if the mesos scheduler receives enough relevant offers.  Relay's
     requests don't build up: only the largest request since the last fulfilled
     request is fulfilled at moment enough mesos resources are available.
+    If launch pacing holds back some of a request's tasks, only those stay
+    requested, until they launch or Relay makes a new request.
     """
     if ns.mesos_master is None:
         log.error(
@@ -89,11 +93,41 @@ def main(ns):
             extra=dict(mesos_framework_name=ns.mesos_framework_name))
         build_arg_parser().print_usage()
         sys.exit(1)
-    if not ns.mesos_task_resources:
-        log.warn(
-            "You didn't define '--mesos_task_resources'."
-            "  Tasks may not start on slaves",
+    for task_type, command, task_resources in [
+            ('warmer', ns.warmer, ns.mesos_warmer_resources),
+            ('cooler', ns.cooler, ns.mesos_cooler_resources)]:
+        if task_resources is None:
+            task_resources = ns.mesos_task_resources
+        if command and not task_resources:
+            log.warn(
+                "You didn't define '--mesos_task_resources' or"
+                " '--mesos_%s_resources'.  %s tasks will not start on slaves"
+                % (task_type, task_type.capitalize()),
+                extra=dict(mesos_framework_name=ns.mesos_framework_name))
+    if ns.mesos_task_fanout < 1:
+        log.error(
+            "--mesos_task_fanout must be a positive number",
             extra=dict(mesos_framework_name=ns.mesos_framework_name))
+        build_arg_parser().print_usage()
+        sys.exit(1)
+    if ns.mesos_task_fanout > 1 and set().union(
+            ns.mesos_task_resources, ns.mesos_warmer_resources or {},
+            ns.mesos_cooler_resources or {}).difference(SCALAR_KEYS):
+        log.error(
+            "--mesos_task_fanout only supports scalar resources, like %s"
+            % ', '.join(sorted(SCALAR_KEYS)),
+            extra=dict(mesos_framework_name=ns.mesos_framework_name))
+        build_arg_parser().print_usage()
+        sys.exit(1)
+    if ns.mesos_task_fanout > 1 and (
+            ns.mesos_health_check_command or ns.mesos_health_check_http):
+        log.error(
+            "--mesos_health_check_command and --mesos_health_check_http"
+            " can't be used with --mesos_task_fanout, because a health check"
+            " would only check one of a task's replicas",
+            extra=dict(mesos_framework_name=ns.mesos_framework_name))
+        build_arg_parser().print_usage()
+        sys.exit(1)
     log.info(
         "Starting Relay Mesos!",
         extra={k: str(v) for k, v in ns.__dict__.items()})
@@ -104,10 +138,24 @@ def main(ns):
     # ie. A positive value of n means n warmer tasks
     MV = mp.Array('d', [0, 0])  # max_val is a ctypes.c_int64
 
+    # num of tasks the mesos scheduler believes are active.  Metrics in the
+    # relay process can read it via
+    # relay_mesos.metrics.num_active_tasks_from_scheduler
+    active_tasks = mp.Value('i', 0)
+    metrics.set_active_tasks_counter(active_tasks)
+
     # store exceptions that may be raised
     exception_receiver, exception_sender = mp.Pipe(False)
-    # notify relay when mesos framework is ready
-    mesos_ready = mp.Condition()
+    # notify relay when mesos framework is ready.  Unlike a Condition, an Event
+    # stays set, so relay can't miss the notification.
+    mesos_ready = mp.Event()
+
+    if ns.mesos_ha_lock:
+        election = ns.mesos_ha_backend(ns.mesos_ha_lock, ns)
+        # standbys run relay all along so its state is warm if they take over
+        mesos_ready.set()
+    else:
+        election = None
 
     # copy and then override warmer and cooler
     ns_relay = ns.__class__(**{k: v for k, v in ns.__dict__.items()})
@@ -120,7 +168,8 @@ def main(ns):
     mesos = mp.Process(
         target=catch(init_mesos_scheduler, exception_sender),
         kwargs=dict(ns=ns, MV=MV, exception_sender=exception_sender,
-                    mesos_ready=mesos_ready),
+                    mesos_ready=mesos_ready, active_tasks=active_tasks,
+                    election=election),
         name=mesos_name)
     relay_name = "Relay.Runner Event Loop"
     relay = mp.Process(
@@ -164,18 +213,32 @@ def main(ns):
 
 
 def init_relay(ns_relay, mesos_ready, mesos_framework_name):
+    # warm up the metric and target (imports, connections, caches) while the
+    # mesos framework registers.  The warm-up values are stale by the time
+    # relay starts, so relay starts from the next values instead.
+    if ns_relay.metric is not None and ns_relay.target is not None:
+        metric, target = ns_relay.metric(), ns_relay.target()
+        next(metric)
+        next(target)
+        ns_relay.metric, ns_relay.target = lambda: metric, lambda: target
+        log.debug(
+            'Relay metric and target are warmed up', extra=dict(
+                mesos_framework_name=mesos_framework_name,
+                seconds_since_start=time.time() - relay_mesos._start_time))
     log.debug(
         'Relay waiting to start until mesos framework is registered',
         extra=dict(mesos_framework_name=mesos_framework_name))
-    mesos_ready.acquire()
     mesos_ready.wait()
     log.debug(
         'Relay notified that mesos framework is registered',
-        extra=dict(mesos_framework_name=mesos_framework_name))
+        extra=dict(
+            mesos_framework_name=mesos_framework_name,
+            seconds_since_start=time.time() - relay_mesos._start_time))
     relay_main(ns_relay)
 
 
-def init_mesos_scheduler(ns, MV, exception_sender, mesos_ready):
+def init_mesos_scheduler(ns, MV, exception_sender, mesos_ready,
+                         active_tasks=None, election=None):
     import mesos.interface
     from mesos.interface import mesos_pb2
     try:
@@ -187,9 +250,19 @@ def init_mesos_scheduler(ns, MV, exception_sender, mesos_ready):
             extra=dict(mesos_framework_name=ns.mesos_framework_name))
         raise
 
+    from relay_mesos.scheduler import Scheduler
+    from relay_mesos.trace import TraceRecorder
+
+    if election is not None:
+        # everything is imported, so a standby is ready to take over quickly
+        wait_for_leadership(
+            election, ns.mesos_ha_poll_interval, ns.mesos_framework_name)
+
     log.info(
         'starting mesos scheduler',
-        extra=dict(mesos_framework_name=ns.mesos_framework_name))
+        extra=dict(
+            mesos_framework_name=ns.mesos_framework_name,
+            seconds_since_start=time.time() - relay_mesos._start_time))
 
     # build framework
     framework = mesos_pb2.FrameworkInfo()
@@ -201,12 +274,34 @@ def init_mesos_scheduler(ns, MV, exception_sender, mesos_ready):
         framework.role = ns.mesos_framework_role
     if ns.mesos_checkpoint:
         framework.checkpoint = True
+    if ns.mesos_failover_timeout is not None:
+        framework.failover_timeout = ns.mesos_failover_timeout
+    elif election is not None:
+        framework.failover_timeout = 60
+    if election is not None:
+        framework_id = election.get_framework_id()
+        if framework_id:
+            framework.id.value = framework_id
+            log.info(
+                'taking over framework from the previous leader', extra=dict(
+                    framework_id=framework_id,
+                    mesos_framework_name=ns.mesos_framework_name))
+
+    if ns.mesos_trace_file:
+        trace = TraceRecorder(ns.mesos_trace_file, ns)
+        log.info(
+            'recording a trace of scheduler events', extra=dict(
+                mesos_trace_file=ns.mesos_trace_file,
+                mesos_framework_name=ns.mesos_framework_name))
+    else:
+        trace = None
 
     # build driver
     driver = mesos.native.MesosSchedulerDriver(
         Scheduler(
             MV=MV, exception_sender=exception_sender, mesos_ready=mesos_ready,
-            ns=ns),
+            ns=ns, active_tasks=active_tasks, trace=trace,
+            election=election),
         framework,
         ns.mesos_master)
     atexit.register(driver.stop)
@@ -217,6 +312,15 @@ def init_mesos_scheduler(ns, MV, exception_sender, mesos_ready):
     sys.exit(status)
 
 
+def _parse_task_resources(x):
+    return dict(y.split('=') for y in x.replace(' ', ',').split(','))
+
+
+def _parse_http_health_check(x):
+    port, _, path = x.partition('/')
+    return (int(port), '/' + path)
+
+
 # This add_argument func will prefix env vars with RELAY_MESOS.
 # The normal at.add_argument func prefixes env vars with RELAY_
 # Let's use the at.add_argument func for --mesos_XXX and the below for --XXX
@@ -263,14 +367,65 @@ build_arg_parser = at.build_arg_parser([
                 " this Relay.Mesos instance dies.")),
         at.add_argument(
             '--mesos_task_resources',
-            type=lambda x: dict(
-                y.split('=') for y in x.replace(' ', ',').split(',')),
+            type=_parse_task_resources,
             default={}, help=(
                 "Specify what resources your task needs to execute.  These"
                 " can be any recognized mesos resource and must be specified"
                 " as a string or comma separated list.  ie:"
                 "  --mesos_task_resources cpus=10,mem=30000"
             )),
+        at.add_argument(
+            '--mesos_warmer_resources',
+            type=_parse_task_resources, help=(
+                "Resources a warmer task needs, if different from"
+                " --mesos_task_resources.  Same format as"
+                " --mesos_task_resources")),
+        at.add_argument(
+            '--mesos_cooler_resources',
+            type=_parse_task_resources, help=(
+                "Resources a cooler task needs, if different from"
+                " --mesos_task_resources.  Same format as"
+                " --mesos_task_resources")),
+        at.add_argument(
+            '--mesos_task_fanout', type=int, default=1, help=(
+                "Run up to this many replicas of the warmer or cooler command"
+                " in one mesos task, which then needs this many times"
+                " --mesos_task_resources.  Fewer tasks means less per-task"
+                " overhead for the mesos master and this scheduler when Relay"
+                " asks for many tasks at once.  The num of replicas per task"
+                " adapts to the size of available offers.  Each replica gets"
+                " a RELAY_MESOS_REPLICA environment variable")),
+        at.add_argument(
+            '--mesos_offer_hoard_seconds', type=float, default=0, help=(
+                "If a slave's offers are too small to fit a task that Relay"
+                " is asking for, hold onto them for up to this many seconds"
+                " rather than declining them right away.  Offers from the"
+                " same slave are combined, so a few partial offers can fit"
+                " larger tasks on busy shared slaves.  Hoarded offers aren't"
+                " available to other frameworks.  By default, offers are not"
+                " hoarded")),
+        at.add_argument(
+            '--mesos_launch_rate', type=float, default=0, help=(
+                "Launch at most this many tasks per second, on average, so"
+                " that services your tasks depend on don't get a thundering"
+                " herd of new workers.  Offers that can't be used yet are"
+                " declined briefly, or hoarded if --mesos_offer_hoard_seconds"
+                " is set.  By default, launches aren't rate limited")),
+        at.add_argument(
+            '--mesos_launch_burst', type=int, default=0, help=(
+                "With --mesos_launch_rate, launch at most this many tasks at"
+                " once.  Defaults to the launch rate")),
+        at.add_argument(
+            '--mesos_launch_ramp', type=float, default=0, help=(
+                "With --mesos_launch_rate, start each burst of launches"
+                " slowly and ramp up to the full launch rate over this many"
+                " seconds.  A burst ends after this many seconds without"
+                " launches")),
+        at.add_argument(
+            '--mesos_max_launching_per_agent', type=int, default=0, help=(
+                "Max number of tasks per slave that may be launched but not"
+                " yet running, or healthy if they have a health check.  By"
+                " default, there is no limit")),
         at.add_argument(
             '--mesos_environment', type=lambda fp: [
                 tuple(y.strip() for y in x.strip().split('=', 1))
@@ -280,6 +435,14 @@ build_arg_parser = at.build_arg_parser([
                 " warmer and cooler tasks."
                 "File should contain one variable per line, in form VAR1=VAL1"
             )),
+        at.add_argument(
+            '--mesos_trace_file', help=(
+                "Record every resource offer, MV snapshot, launch/decline/kill"
+                " decision, status update and offer rescind the scheduler"
+                " handles to this file.  Replay the trace with:"
+                "  python -m relay_mesos.trace FILE"
+                "  Environment values, docker parameters and commands are"
+                " not recorded")),
         add_argument(
             '--uris', type=lambda x: x.split(','), default=[], help=(
                 "Comma-separated list of URIs to load before running command"
@@ -294,6 +457,67 @@ build_arg_parser = at.build_arg_parser([
                 " are starting or completing at once"
             )),
     ),
+    at.group(
+        "Relay.Mesos warmer health check parameters",
+        at.add_argument(
+            '--mesos_health_check_command', help=(
+                "A bash command that exits 0 if a warmer task is healthy."
+                "  Warmer tasks only count as active once healthy, and"
+                " mesos kills tasks that fail too many consecutive checks."
+                "  Can't be used with --mesos_task_fanout")),
+        at.add_argument(
+            '--mesos_health_check_http', type=_parse_http_health_check,
+            help=(
+                "Check warmer task health with an HTTP GET on localhost,"
+                " given as PORT or PORT/path.  ie: 8080/health"
+                "  The check runs curl in the task's sandbox or container")),
+        at.add_argument(
+            '--mesos_health_check_interval', type=float, default=10, help=(
+                "Seconds between health checks")),
+        at.add_argument(
+            '--mesos_health_check_timeout', type=float, default=20, help=(
+                "Seconds after which a health check counts as failed")),
+        at.add_argument(
+            '--mesos_health_check_grace_period', type=float, default=60,
+            help=(
+                "Seconds after a task starts during which failed health"
+                " checks are ignored, ie. while the task warms up")),
+        at.add_argument(
+            '--mesos_health_check_consecutive_failures', type=int, default=3,
+            help=(
+                "Mesos kills a task after this many consecutive failed"
+                " health checks")),
+        at.add_argument(
+            '--mesos_health_check_deadline', type=float, default=300, help=(
+                "Kill warmer tasks that haven't passed a health check this"
+                " many seconds after they were launched.  0 disables this")),
+    ),
+    at.group(
+        "Relay.Mesos high availability parameters",
+        at.add_argument(
+            '--mesos_ha_lock', help=(
+                "Run several Relay.Mesos instances with the same"
+                " --mesos_framework_name and --mesos_ha_lock side by side."
+                "  One instance is the leader and the others are hot"
+                " standbys, one of which takes over the framework if the"
+                " leader dies.  With the default backend, this is a path to a"
+                " lock file on a filesystem all instances share")),
+        at.add_argument(
+            '--mesos_ha_backend', type=load_obj_from_path,
+            default='relay_mesos.ha.FileLockElection', help=(
+                "Import path to the leader election backend to use.  See"
+                " relay_mesos.ha.LeaderElection")),
+        at.add_argument(
+            '--mesos_ha_poll_interval', type=float, default=1, help=(
+                "How many seconds a standby waits between attempts to"
+                " become the leader")),
+        at.add_argument(
+            '--mesos_failover_timeout', type=float, help=(
+                "How many seconds Mesos waits for a new scheduler to take"
+                " over this framework before killing its tasks.  Defaults to"
+                " 60 with --mesos_ha_lock, and to the mesos default"
+                " otherwise")),
+    ),
     at.group(
         "Relay.Mesos Docker parameters",
         add_argument(
@@ -0,0 +1,169 @@
+"""
+Building blocks for Relay metric generators that measure what Relay.Mesos is
+doing on the cluster.
+
+Relay calls each metric generator once per tick, so a naive metric that
+downloads the mesos master's state on every call puts a lot of load on the
+master.  The MasterStateClient defined here keeps connections to the master
+open, caches results for a short time and shares that cache with every
+generator in the process.  If you don't need to ask the master at all,
+`num_active_tasks_from_scheduler` counts tasks using the status updates this
+framework's scheduler already receives.
+"""
+import httplib
+import json
+import os
+import threading
+import time
+import urlparse
+
+from relay_mesos import log
+
+
+# Counters in the mesos master's state.json used to count active tasks
+ACTIVE_TASKS_KEYS = (
+    'started_tasks', 'staged_tasks', 'failed_tasks', 'killed_tasks',
+    'lost_tasks', 'finished_tasks')
+# The same count from the much smaller /metrics/snapshot endpoint
+SNAPSHOT_ACTIVE_TASKS_KEYS = (
+    'master/tasks_staging', 'master/tasks_starting', 'master/tasks_running')
+
+
+class MasterStateClient(object):
+    """
+    Fetch top-level values from a mesos master json endpoint, like
+    http://master:5050/metrics/snapshot or
+    http://master:5050/master/state.json
+
+    `url` the json endpoint to query
+    `ttl` (seconds) how long a fetched result may be reused
+    `timeout` (seconds) socket timeout when talking to the master
+
+    The connection to the master is kept alive between requests.  Prefer
+    /metrics/snapshot where it has the values you need: state.json
+    describes every task and slave and can be many megabytes.
+    """
+    def __init__(self, url, ttl=1, timeout=10):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        parsed = urlparse.urlparse(url)
+        self._conn_cls = (
+            httplib.HTTPSConnection if parsed.scheme == 'https'
+            else httplib.HTTPConnection)
+        self._netloc = parsed.netloc
+        self._path = parsed.path or '/'
+        if parsed.query:
+            self._path += '?' + parsed.query
+        self._conn = None
+        self._keys = set()
+        self._cache = {}
+        self._cache_time = 0
+        self._lock = threading.Lock()
+
+    def get(self, keys):
+        """Return a dict mapping each of the given keys to its value"""
+        with self._lock:
+            self._keys.update(keys)
+            if time.time() - self._cache_time > self.ttl \
+                    or not self._keys.issubset(self._cache):
+                self._cache = self._fetch(self._keys)
+                self._cache_time = time.time()
+            return {k: self._cache[k] for k in keys}
+
+    def _fetch(self, keys):
+        try:
+            return self._fetch_once(keys)
+        except (httplib.HTTPException, IOError):
+            # the master may have closed our kept-alive connection
+            log.debug(
+                'retrying request to mesos master with a new connection',
+                extra=dict(url=self.url))
+            self._close()
+            return self._fetch_once(keys)
+
+    def _fetch_once(self, keys):
+        if self._conn is None:
+            self._conn = self._conn_cls(self._netloc, timeout=self.timeout)
+        self._conn.request('GET', self._path)
+        resp = self._conn.getresponse()
+        if resp.status != 200:
+            resp.read()
+            raise IOError(
+                "Mesos master returned HTTP %s for %s"
+                % (resp.status, self.url))
+        # read the whole response so the connection can be reused
+        data = json.load(resp)
+        missing = set(keys).difference(data)
+        if missing:
+            raise KeyError(
+                "Mesos master response is missing keys: %s" % sorted(missing))
+        return {k: data[k] for k in keys}
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_master_state_client(url, ttl=1):
+    """
+    Return a MasterStateClient for the given url that is shared by all
+    callers in this process
+    """
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = MasterStateClient(url, ttl=ttl)
+        return _clients[url]
+
+
+def num_active_tasks_from_master(url=None, ttl=None):
+    """
+    A metric that yields the number of currently active tasks on the mesos
+    cluster, according to the mesos master.
+
+    `url` defaults to the env var RELAY_MESOS_MASTER_STATE_URL.  Either the
+        master's /metrics/snapshot (cheaper) or its state.json
+    `ttl` defaults to the env var RELAY_MESOS_MASTER_STATE_TTL or 1 second
+    """
+    if url is None:
+        url = os.environ['RELAY_MESOS_MASTER_STATE_URL']
+    if ttl is None:
+        ttl = float(os.environ.get('RELAY_MESOS_MASTER_STATE_TTL', 1))
+    client = get_master_state_client(url, ttl=ttl)
+    if urlparse.urlparse(url).path.rstrip('/').endswith('/metrics/snapshot'):
+        while True:
+            yield sum(client.get(SNAPSHOT_ACTIVE_TASKS_KEYS).values())
+    while True:
+        data = client.get(ACTIVE_TASKS_KEYS)
+        yield data['started_tasks'] + data['staged_tasks'] - (
+            data['failed_tasks'] + data['killed_tasks'] +
+            data['lost_tasks'] + data['finished_tasks'])
+
+
+# a multiprocessing.Value shared with the mesos scheduler process.
+# Relay.Mesos sets this before it starts Relay.
+_active_tasks = None
+
+
+def set_active_tasks_counter(counter):
+    global _active_tasks
+    _active_tasks = counter
+
+
+def num_active_tasks_from_scheduler():
+    """
+    A metric that yields the number of this framework's tasks that are
+    staging, starting or running.  It is computed from the status updates
+    the Relay.Mesos scheduler receives, so it never queries the mesos master.
+    """
+    if _active_tasks is None:
+        raise UserWarning(
+            "num_active_tasks_from_scheduler only works when Relay is"
+            " started by Relay.Mesos")
+    while True:
+        yield _active_tasks.value
@@ -0,0 +1,192 @@
+"""
+Pace how quickly Relay.Mesos launches tasks.
+
+When Relay asks for many tasks and lots of offers are available, launching
+everything at once starts a thundering herd of cold workers.  A LaunchPacer
+limits launches with a token bucket (--mesos_launch_rate and
+--mesos_launch_burst), can ramp the launch rate up over the start of a burst
+(--mesos_launch_ramp) and limits how many tasks may be launching on one slave
+at a time (--mesos_max_launching_per_agent).
+"""
+from __future__ import division
+import time
+
+from mesos.interface import mesos_pb2
+
+from relay_mesos import log
+
+
+# don't ask mesos to re-offer paced offers sooner than this many seconds
+MIN_REFUSE_SECONDS = 1
+
+
+class TokenBucket(object):
+    """
+    Allow `rate` launches per second on average, and at most `burst` at once.
+
+    If `ramp` is given, a burst of launches that starts after `ramp` idle
+    seconds begins with a single launch, and the rate then grows linearly
+    to `rate` over `ramp` seconds.
+
+    `clock` a function returning the current time in seconds
+    """
+    def __init__(self, rate, burst, ramp=0, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.ramp = ramp
+        self.clock = clock
+        self.tokens = burst
+        self.last_refill = clock()
+        self.last_take = None
+        self.burst_start = None
+
+    def _in_burst(self, now):
+        return self.last_take is not None and now - self.last_take <= self.ramp
+
+    def _rate(self, now):
+        if not self.ramp or not self._in_burst(now):
+            return self.rate
+        return self.rate * min(1, (now - self.burst_start) / self.ramp)
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.last_refill) * self._rate(now))
+        self.last_refill = now
+
+    def available(self):
+        """Return the number of launches allowed right now"""
+        now = self.clock()
+        self._refill(now)
+        if self.ramp and not self._in_burst(now):
+            return int(min(self.tokens, 1))
+        return int(self.tokens)
+
+    def take(self, n):
+        now = self.clock()
+        self._refill(now)
+        if self.ramp and not self._in_burst(now):
+            self.burst_start = now
+            self.tokens = min(self.tokens, 1)
+        self.last_take = now
+        self.tokens -= n
+
+    def retry_after(self):
+        """Return num seconds until at least one launch is allowed"""
+        if self.tokens >= 1:
+            return 0
+        rate = max(self._rate(self.clock()), self.rate / 10)
+        return (1 - self.tokens) / rate
+
+
+class LaunchPacer(object):
+    """
+    Decide how many tasks may be launched on each offer right now
+
+    `ns.mesos_launch_rate` (float) max tasks launched per second.  0 means
+        unlimited
+    `ns.mesos_launch_burst` (int) max tasks launched at once.  Defaults to
+        the launch rate
+    `ns.mesos_launch_ramp` (float) seconds over which the launch rate ramps up
+        at the start of a burst
+    `ns.mesos_max_launching_per_agent` (int) max tasks per slave that are
+        launched but not yet running (or healthy, if they have a health
+        check).  0 means unlimited
+
+    If tasks are grouped via --mesos_task_fanout, these limits count command
+    replicas rather than mesos tasks.
+
+    `clock` a function returning the current time in seconds
+    """
+    def __init__(self, ns, clock=time.time):
+        self.ns = ns
+        if ns.mesos_launch_rate:
+            self.bucket = TokenBucket(
+                ns.mesos_launch_rate,
+                ns.mesos_launch_burst or max(1, ns.mesos_launch_rate),
+                ns.mesos_launch_ramp, clock=clock)
+        else:
+            self.bucket = None
+        self.max_per_agent = ns.mesos_max_launching_per_agent
+        # {task_id: (slave_id, replicas, has_health_check)} for tasks that
+        # aren't running, or healthy if they have a health check, yet
+        self.launching = {}
+        # {slave_id: num replicas launching}
+        self.launching_per_agent = {}
+
+    def pace(self, available_offers):
+        """
+        Split a list of (offer, ntasks) into those that may be launched on
+        now, with ntasks reduced as needed, and offers that can't be used
+        right now
+        """
+        if self.bucket is None:
+            tokens = float('inf')
+        else:
+            tokens = self.bucket.available()
+        paced, held = [], []
+        for offer, ntasks in available_offers:
+            n = min(ntasks, tokens)
+            if self.max_per_agent:
+                n = min(n, self.max_per_agent - self.launching_per_agent.get(
+                    offer.slave_id.value, 0))
+            if n <= 0:
+                held.append(offer)
+                continue
+            tokens -= n
+            paced.append((offer, int(n)))
+        if held:
+            log.debug('pacing task launches', extra=dict(
+                num_offers_held=len(held), launch_tokens=tokens,
+                mesos_framework_name=self.ns.mesos_framework_name))
+        return paced, held
+
+    def retry_after(self):
+        """How long to wait before offers held back by the pacer are useful"""
+        if self.bucket is None:
+            return MIN_REFUSE_SECONDS
+        return max(MIN_REFUSE_SECONDS, self.bucket.retry_after())
+
+    def launched(self, offer, tasks, replicas):
+        """
+        Record that `tasks` were launched on `offer`.  `replicas` is the num
+        of command replicas each task runs
+        """
+        if self.bucket is not None:
+            self.bucket.take(sum(replicas))
+        slave_id = offer.slave_id.value
+        for task, n in zip(tasks, replicas):
+            self.launching[task.task_id.value] = (
+                slave_id, n, task.HasField('health_check'))
+            self.launching_per_agent[slave_id] = \
+                self.launching_per_agent.get(slave_id, 0) + n
+
+    def adopt(self, task_id, slave_id, replicas, has_health_check):
+        """
+        Record a task that a previous leader launched and that isn't running
+        (or healthy) yet, so it counts toward the per-slave limit
+        """
+        if task_id in self.launching:
+            return
+        self.launching[task_id] = (slave_id, replicas, has_health_check)
+        self.launching_per_agent[slave_id] = \
+            self.launching_per_agent.get(slave_id, 0) + replicas
+
+    def status_update(self, update):
+        """
+        A task stops counting as launching once it runs, or is healthy if it
+        has a health check, or ends
+        """
+        if update.state in [mesos_pb2.TASK_STAGING, mesos_pb2.TASK_STARTING]:
+            return
+        tid = update.task_id.value
+        if tid not in self.launching:
+            return
+        slave_id, n, has_health_check = self.launching[tid]
+        if update.state == mesos_pb2.TASK_RUNNING and has_health_check \
+                and not (update.HasField('healthy') and update.healthy):
+            return
+        del self.launching[tid]
+        self.launching_per_agent[slave_id] -= n
+        if not self.launching_per_agent[slave_id]:
+            del self.launching_per_agent[slave_id]
@@ -1,4 +1,5 @@
 from __future__ import division
+import math
 import random
 import time
 import sys
@@ -6,25 +7,109 @@ import sys
 import mesos.interface
 from mesos.interface import mesos_pb2
 
+import relay_mesos
 from relay_mesos import log
-from relay_mesos.util import catch
-
-
-# Resource types supported by Mesos
-SCALAR_KEYS = {'cpus': float, 'mem': int, 'disk': int}
-RANGE_KEYS = {'ports': int}
-SET_KEYS = {'disks': str}
+from relay_mesos.pacing import LaunchPacer
+from relay_mesos.util import catch, SCALAR_KEYS, RANGE_KEYS, SET_KEYS
 
 
 class MaxFailuresReached(Exception):
     pass
 
 
+class AgentOffers(object):
+    """
+    All offers from one mesos agent (slave), treated as one offer whose
+    resources are the sum of the offers' resources.  Tasks launched on it
+    consume all of its offers.
+    """
+    def __init__(self, offers):
+        self.offers = offers
+        self.id = offers[0].id
+        self.slave_id = offers[0].slave_id
+        self.hostname = offers[0].hostname
+        self.resources = _sum_resources(offers)
+
+    @property
+    def ids(self):
+        return [offer.id for offer in self.offers]
+
+
+def _sum_resources(offers):
+    """Add up the scalar resources of the given offers"""
+    scalars = {}
+    resources = []
+    for offer in offers:
+        for res in offer.resources:
+            if res.type != mesos_pb2.Value.SCALAR:
+                resources.append(res)
+                continue
+            key = (res.name, res.role)
+            if key not in scalars:
+                scalars[key] = mesos_pb2.Resource()
+                scalars[key].CopyFrom(res)
+                resources.append(scalars[key])
+            else:
+                scalars[key].scalar.value += res.scalar.value
+    return resources
+
+
+def group_offers_by_agent(offers):
+    """
+    Combine mesos Offer instances from the same slave into AgentOffers
+
+    Return a list of AgentOffers, in the order the slaves first appear
+    """
+    grouped = {}
+    order = []
+    for offer in offers:
+        key = offer.slave_id.value
+        if key not in grouped:
+            grouped[key] = []
+            order.append(key)
+        grouped[key].append(offer)
+    return [AgentOffers(grouped[key]) for key in order]
+
+
+def decline_offer(driver, offer, refuse_seconds=None):
+    """
+    Decline a mesos Offer or all offers in an AgentOffers instance
+
+    `refuse_seconds` if given, ask mesos not to re-offer these resources for
+        this many seconds, rather than the mesos default
+    """
+    if isinstance(offer, AgentOffers):
+        offer_ids = offer.ids
+    else:
+        offer_ids = [offer.id]
+    for offer_id in offer_ids:
+        if refuse_seconds is None:
+            driver.declineOffer(offer_id)
+        else:
+            driver.declineOffer(
+                offer_id, mesos_pb2.Filters(refuse_seconds=refuse_seconds))
+
+
+def get_task_resources(ns, MV):
+    """
+    Return the resources a single warmer (if MV >= 0) or cooler (if MV < 0)
+    task consumes.  Defaults to `ns.mesos_task_resources` if
+    `ns.mesos_warmer_resources` or `ns.mesos_cooler_resources` isn't defined.
+    """
+    if MV < 0:
+        task_resources = ns.mesos_cooler_resources
+    else:
+        task_resources = ns.mesos_warmer_resources
+    if task_resources is None:
+        task_resources = ns.mesos_task_resources
+    return dict(task_resources)
+
+
 def filter_offers(offers, task_resources):
     """
     Determine which offers are usable
 
-    `offers` a list of mesos Offer instances
+    `offers` a list of mesos Offer or AgentOffers instances
     `task_resources` the stuff a task would consume:
         {
             "cpus": 10,
@@ -47,9 +132,11 @@ def filter_offers(offers, task_resources):
 
 def calc_tasks_per_offer(offer, task_resources):
     """
-    Decide how many tasks a given mesos Offer can contain.
+    Decide how many tasks a given mesos Offer can contain.  If tasks are
+    grouped via --mesos_task_fanout, this is the num of command replicas the
+    offer can contain.
 
-    `offer` a mesos Offer instance
+    `offer` a mesos Offer or AgentOffers instance
     `resources` the stuff a task would consume:
         {
             "cpus": 10,
@@ -92,41 +179,94 @@ def calc_tasks_per_offer(offer, task_resources):
         return num_tasks
 
 
-def create_tasks(MV, available_offers, driver, command, ns):
+def group_replicas(nreplicas, fanout):
+    """
+    Split `nreplicas` copies of a command into as few mesos tasks as possible
+    such that no task runs more than `fanout` replicas.  Replicas are spread
+    evenly over the tasks.
+
+    Return a list containing the number of replicas each task should run
     """
-    Launch up to `MV` mesos tasks, depending on availability of mesos
-    resources.
+    ntasks = int(math.ceil(nreplicas / fanout))
+    if ntasks == 0:
+        return []
+    q, r = divmod(nreplicas, ntasks)
+    return [q + 1] * r + [q] * (ntasks - r)
 
-    `MV` max number of mesos tasks to spin up.  Relay chooses this number
-    `available_offers` a dict of mesos offers and num tasks they can support
+
+def create_tasks(MV, available_offers, driver, command, ns,
+                 task_resources=None, on_launch=None, health_check=None):
+    """
+    Launch up to `MV` replicas of the command, depending on availability of
+    mesos resources.  Unless `ns.mesos_task_fanout` is larger than 1, each
+    replica is its own mesos task.
+
+    `MV` max number of replicas to spin up.  Relay chooses this number
+    `available_offers` a dict of mesos offers and num replicas they can support
     `driver` a mesos driver instance
+    `task_resources` the stuff one replica consumes.  Defaults to
+        `ns.mesos_task_resources`
+    `on_launch` if given, called as on_launch(offer, tasks, replicas) after
+        tasks are launched, where replicas is the num of command replicas
+        each task runs
+    `health_check` a mesos HealthCheck to attach to each task, or None
     """
+    if task_resources is None:
+        task_resources = dict(ns.mesos_task_resources)
     n_fulfilled = 0
     for offer, ntasks in available_offers:
         if n_fulfilled >= MV:
-            driver.declineOffer(offer.id)
+            decline_offer(driver, offer)
             continue
+        nreplicas = min(ntasks, int(math.ceil(MV - n_fulfilled)))
+        n_fulfilled += nreplicas
         tasks = []
-        for ID in range(ntasks):
-            if n_fulfilled >= MV:
-                break
-            n_fulfilled += 1
-
+        replicas_per_task = group_replicas(nreplicas, ns.mesos_task_fanout)
+        for ID, replicas in enumerate(replicas_per_task):
             tid = "%s.%s.%s" % (
                 ID, offer.id.value, random.randint(1, sys.maxint))
+            if replicas > 1:
+                tid += ".x%s" % replicas
             log.debug(
                 "Accepting offer to start a task", extra=dict(
                     offer_host=offer.hostname, task_id=tid,
+                    replicas=replicas,
                     mesos_framework_name=ns.mesos_framework_name))
             task = _create_task(
-                tid, offer, command, ns)
+                tid, offer, command, ns, replicas, task_resources,
+                health_check)
             tasks.append(task)
-        driver.launchTasks(offer.id, tasks)
+        if isinstance(offer, AgentOffers):
+            driver.launchTasks(offer.ids, tasks)
+        else:
+            driver.launchTasks(offer.id, tasks)
+        if on_launch is not None:
+            on_launch(offer, tasks, replicas_per_task)
     return n_fulfilled
 
 
-def _create_task_add_task_resources(task, ns):
-    task_resources = dict(ns.mesos_task_resources)
+def task_replicas(task_id):
+    """Return the num of command replicas the given mesos task id runs"""
+    suffix = task_id.rsplit('.', 1)[-1]
+    if suffix.startswith('x') and suffix[1:].isdigit():
+        return int(suffix[1:])
+    return 1
+
+
+def _fanout_command(command, replicas):
+    """
+    Wrap a bash command so that it runs `replicas` times in parallel.
+    Each copy gets a RELAY_MESOS_REPLICA env var in [0, replicas), and the
+    wrapper fails if any copy fails.
+    """
+    return (
+        'pids=""; for i in $(seq 0 %s); do'
+        ' (export RELAY_MESOS_REPLICA=$i; %s\n) & pids="$pids $!"; done;'
+        ' rc=0; for pid in $pids; do wait $pid || rc=1; done; exit $rc'
+    ) % (replicas - 1, command)
+
+
+def _create_task_add_task_resources(task, ns, task_resources, replicas=1):
     seen = set()
     for key in set(SCALAR_KEYS).intersection(task_resources):
         seen.add(key)
@@ -134,7 +274,11 @@ def _create_task_add_task_resources(task, ns):
         resource.name = key
         resource.type = mesos_pb2.Value.SCALAR
         typecast = SCALAR_KEYS[key]
-        resource.scalar.value = typecast(task_resources[key])
+        if replicas == 1:
+            resource.scalar.value = typecast(task_resources[key])
+        else:
+            resource.scalar.value = typecast(
+                float(task_resources[key]) * replicas)
 
     for key in set(RANGE_KEYS).intersection(task_resources):
         seen.add(key)
@@ -167,11 +311,40 @@ def _create_task_add_task_resources(task, ns):
             "%s unrecognized_keys: %s" % (msg, unrecognized_keys))
 
 
-def _create_task(tid, offer, command, ns):
+def build_health_check(ns):
+    """
+    Return the mesos HealthCheck that warmer tasks should have, or None.
+
+    HTTP health checks are run as a command, `curl`, inside the task's
+    sandbox or container.
+    """
+    if ns.mesos_health_check_command:
+        command = ns.mesos_health_check_command
+    elif ns.mesos_health_check_http:
+        port, path = ns.mesos_health_check_http
+        command = "curl -sf -o /dev/null 'http://localhost:%s%s'" % (
+            port, path)
+    else:
+        return None
+    return mesos_pb2.HealthCheck(
+        command=mesos_pb2.CommandInfo(value=command),
+        interval_seconds=ns.mesos_health_check_interval,
+        timeout_seconds=ns.mesos_health_check_timeout,
+        grace_period_seconds=ns.mesos_health_check_grace_period,
+        consecutive_failures=ns.mesos_health_check_consecutive_failures)
+
+
+def _create_task(tid, offer, command, ns, replicas=1, task_resources=None,
+                 health_check=None):
     """
     `tid` (str) task id
-    `offer` a mesos Offer instance
-    `ns.mesos_task_resources` the stuff a task would consume:
+    `offer` a mesos Offer or AgentOffers instance
+    `replicas` (int) num copies of the command this task runs in parallel.
+        The task's resources are `replicas` times `task_resources`
+    `health_check` (mesos HealthCheck|None) how mesos should decide whether
+        the task is healthy
+    `task_resources` the stuff a task would consume.  Defaults to
+        `ns.mesos_task_resources`:
         {
             "cpus": 10,
             "mem": 1,
@@ -187,6 +360,8 @@ def _create_task(tid, offer, command, ns):
           ("/my/directory", "/path/on/container", "ro")
         ]
     """
+    if replicas > 1:
+        command = _fanout_command(command, replicas)
     task = dict(
         task_id=mesos_pb2.TaskID(value=tid),
         slave_id=offer.slave_id,
@@ -198,6 +373,8 @@ def _create_task(tid, offer, command, ns):
                 for k, v in ns.mesos_environment])
         )
     )
+    if health_check is not None:
+        task.update(health_check=health_check)
     if ns.mesos_framework_name:
         task.update(
             name="relay.mesos task: %s: %s" % (ns.mesos_framework_name, tid))
@@ -226,17 +403,48 @@ def _create_task(tid, offer, command, ns):
                 )
             ))
     task = mesos_pb2.TaskInfo(**task)
-    _create_task_add_task_resources(task, ns)
+    if task_resources is None:
+        task_resources = dict(ns.mesos_task_resources)
+    _create_task_add_task_resources(task, ns, task_resources, replicas)
     return task
 
 
 class Scheduler(mesos.interface.Scheduler):
-    def __init__(self, MV, exception_sender, mesos_ready, ns):
+    def __init__(self, MV, exception_sender, mesos_ready, ns,
+                 active_tasks=None, trace=None, election=None,
+                 clock=time.time):
         self.ns = ns
+        # returns the time used for launch pacing, offer hoarding and health
+        # check deadlines.  Trace replay swaps in the recorded time
+        self.clock = clock
         self.MV = MV
         self.mesos_ready = mesos_ready
         self.exception_sender = exception_sender
         self.failures = 0
+        # ids of tasks that are staging, starting or running, and the num of
+        # replicas each runs.  The total num of replicas is shared with Relay
+        # through `active_tasks`, a multiprocessing.Value
+        self.active_task_ids = {}
+        self.active_tasks = active_tasks
+        # a relay_mesos.trace.TraceRecorder, if recording is enabled
+        self.trace = trace
+        # offers held back because, so far, their slave can't fit a task.
+        # {offer_id: (offer, time received)}
+        self.hoarded_offers = {}
+        self._offer_times = {}
+        # a relay_mesos.ha.LeaderElection, if running in high availability mode
+        self.election = election
+        # the framework id this scheduler registered with, once registered
+        self.framework_id = None
+        if ns.mesos_launch_rate or ns.mesos_max_launching_per_agent:
+            self.pacer = LaunchPacer(ns, clock=clock)
+        else:
+            self.pacer = None
+        # warmer tasks with a health check don't count as active until
+        # healthy.  {task_id: launch time} for tasks never healthy so far
+        self.health_check = build_health_check(ns)
+        self.awaiting_health = {}
+        self.unhealthy_task_ids = set()
 
     def registered(self, driver, frameworkId, masterInfo):
         """
@@ -251,9 +459,13 @@ class Scheduler(mesos.interface.Scheduler):
             driver, frameworkId, masterInfo)
 
     def _registered(self, driver, frameworkId, masterInfo):
-        self.mesos_ready.acquire()
-        self.mesos_ready.notify()
-        self.mesos_ready.release()
+        self.framework_id = frameworkId.value
+        if self.election is not None:
+            if self.election.get_framework_id() == frameworkId.value:
+                self._reconcile_tasks(driver)
+            else:
+                self.election.set_framework_id(frameworkId.value)
+        self.mesos_ready.set()
 
         log.info(
             "Registered with master", extra=dict(
@@ -261,8 +473,21 @@ class Scheduler(mesos.interface.Scheduler):
                 master_hostname=masterInfo.hostname, master_id=masterInfo.id,
                 master_ip=masterInfo.ip, master_port=masterInfo.port,
                 mesos_framework_name=self.ns.mesos_framework_name,
+                seconds_since_start=time.time() - relay_mesos._start_time,
             ))
 
+    def _reconcile_tasks(self, driver):
+        """
+        We took over a framework from a previous leader, so we don't know
+        which of its tasks are running.  Ask mesos to send a status update
+        for each of them.  Those updates are counted like any other, so the
+        active task count catches up without launching tasks all over again.
+        """
+        log.info(
+            'reconciling tasks of the framework we took over', extra=dict(
+                mesos_framework_name=self.ns.mesos_framework_name))
+        driver.reconcileTasks([])
+
     def reregistered(self, driver, masterInfo):
         log.info(
             "Re-registered with master", extra=dict(
@@ -273,8 +498,13 @@ class Scheduler(mesos.interface.Scheduler):
             ))
 
     def resourceOffers(self, driver, offers):
+        if self.trace is not None:
+            self.trace.offers(offers)
+            driver = self.trace.wrap_driver(driver)
         catch(self._resourceOffers, self.exception_sender)(
             driver, offers)
+        if self.trace is not None:
+            self.trace.flush()
 
     def _resourceOffers(self, driver, offers):
         """
@@ -294,10 +524,24 @@ class Scheduler(mesos.interface.Scheduler):
         log.debug("Got resource offers", extra=dict(
             num_offers=len(offers),
             mesos_framework_name=self.ns.mesos_framework_name))
+        self._kill_tasks_that_never_became_healthy(driver)
+        offers = self._unhoard_offers(driver, offers)
+        agents = group_offers_by_agent(offers)
+        # the direction of MV decides whether offers must fit a warmer or a
+        # cooler task
+        with self.MV.get_lock():
+            MV, t = self.MV
+        if self.trace is not None:
+            self.trace.mv(MV, t)
+        task_resources = get_task_resources(self.ns, MV)
         available_offers, decline_offers = filter_offers(
-            offers, dict(self.ns.mesos_task_resources))
-        for offer in decline_offers:
-            driver.declineOffer(offer.id)
+            agents, task_resources)
+        # hoarding hides resources from other frameworks.  Only worth it if
+        # relay is asking for tasks.
+        has_demand = bool(
+            MV > 0 and self.ns.warmer or MV < 0 and self.ns.cooler)
+        for agent in decline_offers:
+            self._hoard_or_decline(driver, agent, hoard=has_demand)
         if not available_offers:
             log.debug(
                 'None of the mesos offers had enough relevant resources',
@@ -308,23 +552,135 @@ class Scheduler(mesos.interface.Scheduler):
                 available_offers=len(available_offers),
                 max_runnable_tasks=sum(x[1] for x in available_offers),
                 mesos_framework_name=self.ns.mesos_framework_name))
-        MV, command = self._get_and_update_relay(available_offers)
+        is_cooler = MV < 0
+        MV, t, command = self._get_relay_command(is_cooler)
 
         if command is None:
+            self._update_relay(MV, t, is_cooler)
             for offer, _ in available_offers:
-                driver.declineOffer(offer.id)
+                decline_offer(driver, offer)
             return
-        create_tasks(
+        n_runnable = min(abs(MV), sum(x[1] for x in available_offers))
+        if self.pacer is not None:
+            available_offers, held_offers = self.pacer.pace(available_offers)
+            for agent in held_offers:
+                self._hoard_or_decline(
+                    driver, agent, self.pacer.retry_after())
+        n_fulfilled = create_tasks(
             MV=abs(MV), available_offers=available_offers,
-            driver=driver, command=command, ns=self.ns
+            driver=driver, command=command, ns=self.ns,
+            task_resources=task_resources, on_launch=self._launched,
+            health_check=self.health_check if MV > 0 else None
         )
+        # tasks the offers could fit but the pacer held back remain requested
+        self._update_relay(
+            MV, t, is_cooler, n_held=max(n_runnable - n_fulfilled, 0))
         driver.reviveOffers()
 
-    def _get_and_update_relay(self, available_offers):
+    def _launched(self, offer, tasks, replicas):
+        if self.pacer is not None:
+            self.pacer.launched(offer, tasks, replicas)
+        now = self.clock()
+        for task in tasks:
+            if task.HasField('health_check'):
+                self.awaiting_health[task.task_id.value] = now
+
+    def _kill_tasks_that_never_became_healthy(self, driver):
+        """
+        Kill tasks that have not passed a health check within
+        --mesos_health_check_deadline seconds of being launched
+        """
+        if not self.awaiting_health or not self.ns.mesos_health_check_deadline:
+            return
+        now = self.clock()
+        for tid, t in self.awaiting_health.items():
+            if now - t < self.ns.mesos_health_check_deadline:
+                continue
+            log.warn(
+                'Killing task that never became healthy', extra=dict(
+                    task_id=tid, seconds_since_launch=now - t,
+                    mesos_framework_name=self.ns.mesos_framework_name))
+            driver.killTask(mesos_pb2.TaskID(value=tid))
+            del self.awaiting_health[tid]
+            self.unhealthy_task_ids.add(tid)
+
+    def _unhoard_offers(self, driver, offers):
+        """
+        Return the given offers plus any hoarded offers that are still fresh
+        enough to use.  Decline the rest.
+        """
+        self._decline_expired_hoarded_offers(driver)
+        unhoarded = self.hoarded_offers.values()
+        self.hoarded_offers.clear()
+        self._offer_times = dict(
+            (offer.id.value, t) for offer, t in unhoarded)
+        return [offer for offer, _ in unhoarded] + list(offers)
+
+    def _decline_expired_hoarded_offers(self, driver):
+        """
+        Decline hoarded offers held longer than --mesos_offer_hoard_seconds.
+        This runs on status updates too, so offers don't stay hoarded just
+        because mesos has no new offers for us.
+        """
+        now = self.clock()
+        for offer_id, (offer, t) in self.hoarded_offers.items():
+            if now - t > self.ns.mesos_offer_hoard_seconds:
+                driver.declineOffer(offer.id)
+                del self.hoarded_offers[offer_id]
+
+    def _hoard_or_decline(self, driver, agent, refuse_seconds=None,
+                          hoard=True):
+        """
+        Offers from a slave that can't fit a task yet, or that launch pacing
+        can't use yet, are held onto for up to --mesos_offer_hoard_seconds.
+        Otherwise, they're declined.
+
+        `refuse_seconds` if declined, how long mesos should wait before
+            offering these resources again
+        `hoard` (bool) if False, always decline
+        """
+        if not hoard or not self.ns.mesos_offer_hoard_seconds:
+            decline_offer(driver, agent, refuse_seconds)
+            return
+        now = self.clock()
+        for offer in agent.offers:
+            self.hoarded_offers[offer.id.value] = (
+                offer, self._offer_times.get(offer.id.value, now))
+
+    def _get_relay_command(self, is_cooler):
         """
         Get num tasks I should create and evaluate whether to use Relay's
-        warmer or cooler command.  Update the MV with number of commands about
-        to be created.
+        warmer or cooler command.
+
+        `is_cooler` whether the available offers were evaluated for cooler
+            tasks.  If Relay has since changed its mind, no command is chosen.
+        """
+        command = None
+        with self.MV.get_lock():
+            MV, t = self.MV
+        # create tasks that fulfill relay's requests or return
+        if MV == 0:
+            log.debug(
+                'mesos scheduler has received no requests from relay',
+                extra=dict(mesos_framework_name=self.ns.mesos_framework_name))
+        elif (MV < 0) != is_cooler:
+            log.debug(
+                'relay switched between warmer and cooler while offers'
+                ' were evaluated', extra=dict(
+                    mesos_framework_name=self.ns.mesos_framework_name))
+        elif MV > 0 and self.ns.warmer:
+            command = self.ns.warmer
+        elif MV < 0 and self.ns.cooler:
+            command = self.ns.cooler
+        return (MV, t, command)
+
+    def _update_relay(self, MV, t, is_cooler, n_held=0):
+        """
+        Mark Relay's request, `MV` made at time `t`, as handled.  Only the
+        `n_held` tasks that launch pacing held back stay requested.
+
+        `is_cooler` whether the available offers were evaluated for cooler
+            tasks.  If Relay has since changed its mind, the MV is left alone.
 
         Competes for the MV with these other threads, and will wait
         indefinitely for it:
@@ -333,36 +689,34 @@ class Scheduler(mesos.interface.Scheduler):
           - Relay warmer and cooler functions attempting to ask the Framework
             to execute more tasks.
         """
-        command = None
+        if MV == 0 or (MV < 0) != is_cooler:
+            return
         with self.MV.get_lock():
-            MV, t = self.MV
-            # create tasks that fulfill relay's requests or return
-            if MV == 0:
-                log.debug(
-                    'mesos scheduler has received no requests from relay',
-                    extra=dict(
-                        mesos_framework_name=self.ns.mesos_framework_name))
-            else:
-                if MV > 0 and self.ns.warmer:
-                    command = self.ns.warmer
-                elif MV < 0 and self.ns.cooler:
-                    command = self.ns.cooler
-                if abs(MV) < len(available_offers):
-                    self.MV[:] = [0, time.time()]
-                else:
-                    new_MV = MV - (MV > 0 or -1) * max(abs(MV),
-                                                       len(available_offers))
-                    self.MV[:] = [new_MV, time.time()]
-        return (MV, command)
+            if self.MV[1] != t:
+                return  # relay has since made a new request
+            self.MV[:] = [n_held * (-1 if is_cooler else 1), time.time()]
 
     def statusUpdate(self, driver, update):
+        if self.trace is not None:
+            self.trace.status(update)
+            driver = self.trace.wrap_driver(driver)
         catch(self._statusUpdate, self.exception_sender)(driver, update)
+        if self.trace is not None:
+            self.trace.flush()
 
     def _statusUpdate(self, driver, update):
         log.debug('task status update: %s' % str(update.message), extra=dict(
             task_id=update.task_id.value, task_state=update.state,
             slave_id=update.slave_id.value, timestamp=update.timestamp,
+            healthy=update.healthy if update.HasField('healthy') else None,
             mesos_framework_name=self.ns.mesos_framework_name))
+        self._adopt_reconciled_task(update)
+        self._update_health(update)
+        self._kill_tasks_that_never_became_healthy(driver)
+        self._decline_expired_hoarded_offers(driver)
+        self._update_active_tasks(update)
+        if self.pacer is not None:
+            self.pacer.status_update(update)
         if self.ns.max_failures == -1:
             return  # don't quit even if you are getting failures
 
@@ -379,6 +733,94 @@ class Scheduler(mesos.interface.Scheduler):
             driver.stop()
             raise MaxFailuresReached(self.failures)
 
+    def _adopt_reconciled_task(self, update):
+        """
+        Tasks of a framework taken over from a previous leader are only
+        known through reconciliation.  Track their health and launching
+        state as if this scheduler had launched them at takeover time.
+
+        Reconciliation doesn't tell which tasks have a health check, so
+        while one is configured, any active task that hasn't reported
+        health yet is treated as awaiting health.
+        """
+        m = mesos_pb2
+        tid = update.task_id.value
+        if update.reason != m.TaskStatus.REASON_RECONCILIATION \
+                or tid in self.active_task_ids \
+                or update.state not in [
+                    m.TASK_STAGING, m.TASK_STARTING, m.TASK_RUNNING]:
+            return
+        has_health_check = self.health_check is not None
+        awaiting_health = has_health_check and not update.HasField('healthy')
+        if awaiting_health:
+            self.awaiting_health[tid] = self.clock()
+        if self.pacer is not None and (
+                update.state != m.TASK_RUNNING or awaiting_health):
+            self.pacer.adopt(
+                tid, update.slave_id.value, task_replicas(tid),
+                has_health_check)
+
+    def _update_health(self, update):
+        m = mesos_pb2
+        tid = update.task_id.value
+        if update.state not in [
+                m.TASK_STAGING, m.TASK_STARTING, m.TASK_RUNNING]:
+            self.awaiting_health.pop(tid, None)
+            self.unhealthy_task_ids.discard(tid)
+        elif not update.HasField('healthy'):
+            return
+        elif update.healthy:
+            if self.awaiting_health.pop(tid, None) is not None \
+                    or tid in self.unhealthy_task_ids:
+                log.info('task is healthy', extra=dict(
+                    task_id=tid,
+                    mesos_framework_name=self.ns.mesos_framework_name))
+            self.unhealthy_task_ids.discard(tid)
+        elif tid not in self.awaiting_health:
+            log.warn('task is unhealthy', extra=dict(
+                task_id=tid,
+                mesos_framework_name=self.ns.mesos_framework_name))
+            self.unhealthy_task_ids.add(tid)
+
+    def _update_active_tasks(self, update):
+        """
+        Keep track of the num of replicas that are staging, starting or
+        running.  Tasks with a health check only count while healthy.
+        """
+        m = mesos_pb2
+        if update.state in [m.TASK_STAGING, m.TASK_STARTING, m.TASK_RUNNING]:
+            self.active_task_ids[update.task_id.value] = task_replicas(
+                update.task_id.value)
+        else:
+            self.active_task_ids.pop(update.task_id.value, None)
+        if self.active_tasks is not None:
+            self.active_tasks.value = sum(
+                n for tid, n in self.active_task_ids.items()
+                if tid not in self.awaiting_health
+                and tid not in self.unhealthy_task_ids)
+
+    def error(self, driver, message):
+        """
+        Invoked when there is an unrecoverable error in the scheduler or
+        scheduler driver.  The driver will be aborted BEFORE invoking this
+        callback.
+        """
+        catch(self._error, self.exception_sender)(driver, message)
+
+    def _error(self, driver, message):
+        log.error('mesos scheduler error: %s' % message, extra=dict(
+            framework_id=self.framework_id,
+            mesos_framework_name=self.ns.mesos_framework_name))
+        if self.election is not None and self.framework_id is None:
+            # mesos refused to let us register with the stored framework id,
+            # ie. because it removed the framework after its failover
+            # timeout.  Register as a new framework next time.
+            log.warn(
+                'forgetting the stored framework id', extra=dict(
+                    framework_id=self.election.get_framework_id(),
+                    mesos_framework_name=self.ns.mesos_framework_name))
+            self.election.clear_framework_id()
+
     def frameworkMessage(self, driver, executorId, slaveId, message):
         """
         Invoked when a slave has been determined unreachable (e.g.,
@@ -398,6 +840,11 @@ class Scheduler(mesos.interface.Scheduler):
         however, that this is currently not true if the slave sending the
         status update is lost/fails during that time).
         """
+        if self.trace is not None:
+            self.trace.rescind(offerId)
+            self.trace.flush()
         log.debug('offer rescinded', extra=dict(
             offer_id=offerId.value,
             mesos_framework_name=self.ns.mesos_framework_name))
+        self.hoarded_offers.pop(offerId.value, None)
+        self._offer_times.pop(offerId.value, None)
@@ -0,0 +1,407 @@
+"""
+Record what the Relay.Mesos scheduler sees and decides, and replay it.
+
+A trace is a compact binary log of every resource offer batch, MV snapshot,
+launch / decline / kill decision, status update and offer rescind the
+scheduler handles.  Enable
+recording with --mesos_trace_file.  Replay a trace through the Scheduler,
+using a fake driver, with:
+
+    python -m relay_mesos.trace /path/to/trace [--speed N]
+
+File format:  a header, MAGIC + uint32 length + json, followed by records.
+Each record is a (uint8 kind, double timestamp, uint32 length) struct
+followed by `length` bytes of payload.  Protobuf messages in a payload are
+stored as uint32 length + serialized message.
+"""
+import argparse
+import json
+import struct
+import sys
+import time
+
+from mesos.interface import mesos_pb2
+
+from relay_mesos import log
+
+
+MAGIC = b'RMTRACE1'
+
+OFFERS = 1
+MV = 2
+LAUNCH = 3
+DECLINE = 4
+STATUS = 5
+REVIVE = 6
+KILL = 7
+RESCIND = 8
+
+# The Relay.Mesos options a trace header stores for replay.  Environment
+# values, docker parameters and the like are left out of traces because they
+# often hold credentials.
+REPLAY_OPTIONS = (
+    'mesos_framework_name', 'max_failures', 'mesos_task_resources',
+    'mesos_warmer_resources', 'mesos_cooler_resources', 'mesos_task_fanout',
+    'mesos_offer_hoard_seconds', 'mesos_launch_rate', 'mesos_launch_burst',
+    'mesos_launch_ramp', 'mesos_max_launching_per_agent',
+    'mesos_health_check_http', 'mesos_health_check_interval',
+    'mesos_health_check_timeout', 'mesos_health_check_grace_period',
+    'mesos_health_check_consecutive_failures',
+    'mesos_health_check_deadline')
+# Commands may embed credentials too.  Replay only needs to know if they
+# are set, so the header stores a bool and replay runs `true` instead.
+REPLAY_COMMAND_OPTIONS = ('warmer', 'cooler', 'mesos_health_check_command')
+_REPLAY_COMMAND = 'true'
+
+_RECORD = struct.Struct('!BdI')
+_UINT = struct.Struct('!I')
+_MV = struct.Struct('!dd')
+
+
+def _pack_msgs(msgs):
+    return b''.join(
+        _UINT.pack(len(data)) + data
+        for data in (msg.SerializeToString() for msg in msgs))
+
+
+def _unpack_msgs(payload, msg_cls, offset=0, count=None):
+    msgs = []
+    while offset < len(payload) and (count is None or len(msgs) < count):
+        size, = _UINT.unpack_from(payload, offset)
+        offset += _UINT.size
+        msgs.append(msg_cls.FromString(payload[offset:offset + size]))
+        offset += size
+    return msgs, offset
+
+
+def _strip_task(task):
+    """Return a copy of a TaskInfo without env values or docker parameters"""
+    stripped = mesos_pb2.TaskInfo()
+    stripped.CopyFrom(task)
+    if stripped.HasField('command'):
+        stripped.command.ClearField('environment')
+    if stripped.container.HasField('docker'):
+        stripped.container.docker.ClearField('parameters')
+    return stripped
+
+
+class TraceRecorder(object):
+    """
+    Append scheduler events to a trace file.
+
+    `path` file to write the trace to
+    `ns` the Relay.Mesos argparse namespace.  The scheduling options in it
+        are stored in the trace header so the trace can be replayed with the
+        same configuration
+
+    Task environment variables and docker parameters are not recorded.
+    """
+    def __init__(self, path, ns):
+        self.fp = open(path, 'wb')
+        options = {k: getattr(ns, k, None) for k in REPLAY_OPTIONS}
+        options.update(
+            (k, bool(getattr(ns, k, None))) for k in REPLAY_COMMAND_OPTIONS)
+        header = json.dumps(
+            dict(ns=options, created=time.time()), default=repr)
+        self.fp.write(MAGIC + _UINT.pack(len(header)) + header)
+        self.fp.flush()
+
+    def _write(self, kind, payload):
+        self.fp.write(_RECORD.pack(kind, time.time(), len(payload)))
+        self.fp.write(payload)
+
+    def offers(self, offers):
+        self._write(OFFERS, _pack_msgs(offers))
+
+    def mv(self, mv, t):
+        self._write(MV, _MV.pack(mv, t))
+
+    def launch(self, offer_ids, tasks):
+        if isinstance(offer_ids, mesos_pb2.OfferID):
+            offer_ids = [offer_ids]
+        self._write(
+            LAUNCH,
+            _UINT.pack(len(offer_ids)) + _pack_msgs(offer_ids) +
+            _pack_msgs(_strip_task(task) for task in tasks))
+
+    def decline(self, offer_id):
+        self._write(DECLINE, offer_id.SerializeToString())
+
+    def revive(self):
+        self._write(REVIVE, b'')
+
+    def kill(self, task_id):
+        self._write(KILL, task_id.SerializeToString())
+
+    def rescind(self, offer_id):
+        self._write(RESCIND, offer_id.SerializeToString())
+
+    def status(self, update):
+        self._write(STATUS, update.SerializeToString())
+
+    def flush(self):
+        self.fp.flush()
+
+    def wrap_driver(self, driver):
+        return TracingDriver(driver, self)
+
+
+class TracingDriver(object):
+    """Proxy a mesos driver and record the decisions the scheduler makes"""
+    def __init__(self, driver, recorder):
+        self._driver = driver
+        self._recorder = recorder
+
+    def launchTasks(self, offer_ids, tasks, *args, **kwargs):
+        self._recorder.launch(offer_ids, tasks)
+        return self._driver.launchTasks(offer_ids, tasks, *args, **kwargs)
+
+    def declineOffer(self, offer_id, *args, **kwargs):
+        self._recorder.decline(offer_id)
+        return self._driver.declineOffer(offer_id, *args, **kwargs)
+
+    def reviveOffers(self):
+        self._recorder.revive()
+        return self._driver.reviveOffers()
+
+    def killTask(self, task_id):
+        self._recorder.kill(task_id)
+        return self._driver.killTask(task_id)
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+def read_trace(path):
+    """
+    Return the trace header and a list of (kind, timestamp, data) events,
+    where data depends on the kind of event:
+
+        OFFERS: [Offer, ...]
+        MV: (MV, t)
+        LAUNCH: ([OfferID, ...], [TaskInfo, ...])
+        DECLINE: OfferID
+        STATUS: TaskStatus
+        REVIVE: None
+        KILL: TaskID
+        RESCIND: OfferID
+    """
+    with open(path, 'rb') as fp:
+        buf = fp.read()
+    if not buf.startswith(MAGIC):
+        raise UserWarning("Not a Relay.Mesos trace file: %s" % path)
+    offset = len(MAGIC)
+    size, = _UINT.unpack_from(buf, offset)
+    offset += _UINT.size
+    header = json.loads(buf[offset:offset + size])
+    offset += size
+
+    events = []
+    while offset + _RECORD.size <= len(buf):
+        kind, ts, size = _RECORD.unpack_from(buf, offset)
+        offset += _RECORD.size
+        payload = buf[offset:offset + size]
+        offset += size
+        if len(payload) < size:
+            break  # the recorder was killed mid-write
+        if kind == OFFERS:
+            data, _ = _unpack_msgs(payload, mesos_pb2.Offer)
+        elif kind == MV:
+            data = _MV.unpack(payload)
+        elif kind == LAUNCH:
+            n, = _UINT.unpack_from(payload)
+            offer_ids, pos = _unpack_msgs(
+                payload, mesos_pb2.OfferID, _UINT.size, n)
+            tasks, _ = _unpack_msgs(payload, mesos_pb2.TaskInfo, pos)
+            data = (offer_ids, tasks)
+        elif kind == DECLINE:
+            data = mesos_pb2.OfferID.FromString(payload)
+        elif kind == STATUS:
+            data = mesos_pb2.TaskStatus.FromString(payload)
+        elif kind == REVIVE:
+            data = None
+        elif kind == KILL:
+            data = mesos_pb2.TaskID.FromString(payload)
+        elif kind == RESCIND:
+            data = mesos_pb2.OfferID.FromString(payload)
+        else:
+            raise UserWarning("Unrecognized trace event kind: %s" % kind)
+        events.append((kind, ts, data))
+    return header, events
+
+
+class FakeDriver(object):
+    """A stand-in for a MesosSchedulerDriver that records what it's asked"""
+    def __init__(self):
+        self.launched = {}
+        self.declined = []
+        self.revives = 0
+        self.killed = []
+        self.stopped = False
+
+    def launchTasks(self, offer_ids, tasks, *args, **kwargs):
+        if isinstance(offer_ids, mesos_pb2.OfferID):
+            offer_ids = [offer_ids]
+        key = tuple(sorted(x.value for x in offer_ids))
+        self.launched[key] = self.launched.get(key, 0) + len(tasks)
+
+    def declineOffer(self, offer_id, *args, **kwargs):
+        self.declined.append(offer_id.value)
+
+    def reviveOffers(self):
+        self.revives += 1
+
+    def stop(self, *args, **kwargs):
+        self.stopped = True
+
+    def killTask(self, task_id):
+        self.killed.append(task_id.value)
+
+
+class _ReplayMV(list):
+    """Mimic the multiprocessing.Array the scheduler shares with Relay"""
+    class _Lock(object):
+        def __enter__(self):
+            pass
+
+        def __exit__(self, *args):
+            pass
+
+    def get_lock(self):
+        return self._Lock()
+
+
+class _ReplayClock(object):
+    """Tell the scheduler it's the time the replayed event was recorded"""
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class _RaiseOnSend(object):
+    """Make the scheduler's catch(...) wrappers fail loudly during replay"""
+    def send(self, exception):
+        raise exception
+
+
+def _recorded_callbacks(events):
+    """
+    Group trace events by the resourceOffers, statusUpdate or offerRescinded
+    callback they belong to
+    """
+    callbacks = []
+    for kind, ts, data in events:
+        if kind in (OFFERS, STATUS, RESCIND):
+            callbacks.append(dict(
+                kind=kind, ts=ts, data=data, MV=None, launched={},
+                declined=0, killed=0))
+        elif not callbacks:
+            continue
+        elif kind == MV:
+            callbacks[-1]['MV'] = data
+        elif kind == LAUNCH:
+            key = tuple(sorted(x.value for x in data[0]))
+            launched = callbacks[-1]['launched']
+            launched[key] = launched.get(key, 0) + len(data[1])
+        elif kind == DECLINE:
+            callbacks[-1]['declined'] += 1
+        elif kind == KILL:
+            callbacks[-1]['killed'] += 1
+    return callbacks
+
+
+def replay(path, speed=0, scheduler_cls=None):
+    """
+    Feed a recorded trace back through a Scheduler and compare its decisions
+    to the recorded ones.
+
+    `path` a trace file written by TraceRecorder
+    `speed` replay this many times faster than real time.  0 means replay as
+        fast as possible.
+    `scheduler_cls` the Scheduler class to replay against.  Useful for
+        checking whether a scheduling change affects throughput or placement.
+        It is given a `clock` that returns the recorded time of each event.
+    """
+    if scheduler_cls is None:
+        from relay_mesos.scheduler import Scheduler as scheduler_cls
+    from relay_mesos.main import build_arg_parser as relay_mesos_ap
+    header, events = read_trace(path)
+    # options added since the trace was recorded get their default values
+    ns = relay_mesos_ap().parse_args([])
+    ns.__dict__.update(header['ns'])
+    for k in REPLAY_COMMAND_OPTIONS:
+        if getattr(ns, k) is True:
+            setattr(ns, k, _REPLAY_COMMAND)
+    # the recorded run may have stopped at --max_failures.  Replay all of it
+    ns.max_failures = -1
+    MV = _ReplayMV([0, 0])
+    clock = _ReplayClock(header['created'])
+    scheduler = scheduler_cls(
+        MV=MV, exception_sender=_RaiseOnSend(), mesos_ready=None, ns=ns,
+        clock=clock)
+
+    stats = dict(
+        offer_callbacks=0, status_updates=0, offers_rescinded=0,
+        mismatched_callbacks=0,
+        recorded_tasks_launched=0, replayed_tasks_launched=0,
+        recorded_declines=0, replayed_declines=0,
+        recorded_kills=0, replayed_kills=0)
+    callbacks = _recorded_callbacks(events)
+    start = time.time()
+    first_ts = callbacks[0]['ts'] if callbacks else 0
+    for cb in callbacks:
+        if speed:
+            delay = (cb['ts'] - first_ts) / speed - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+        clock.now = cb['ts']
+        driver = FakeDriver()
+        if cb['kind'] == STATUS:
+            stats['status_updates'] += 1
+            scheduler.statusUpdate(driver, cb['data'])
+        elif cb['kind'] == RESCIND:
+            stats['offers_rescinded'] += 1
+            scheduler.offerRescinded(driver, cb['data'])
+        else:
+            stats['offer_callbacks'] += 1
+            if cb['MV'] is not None:
+                MV[:] = cb['MV']
+            scheduler.resourceOffers(driver, cb['data'])
+        stats['recorded_tasks_launched'] += sum(cb['launched'].values())
+        stats['replayed_tasks_launched'] += sum(driver.launched.values())
+        stats['recorded_declines'] += cb['declined']
+        stats['replayed_declines'] += len(driver.declined)
+        stats['recorded_kills'] += cb['killed']
+        stats['replayed_kills'] += len(driver.killed)
+        if cb['launched'] != driver.launched \
+                or cb['declined'] != len(driver.declined) \
+                or cb['killed'] != len(driver.killed):
+            stats['mismatched_callbacks'] += 1
+    stats['elapsed_seconds'] = time.time() - start
+    stats['recorded_seconds'] = (
+        callbacks[-1]['ts'] - first_ts if callbacks else 0)
+    return stats
+
+
+def build_arg_parser():
+    ap = argparse.ArgumentParser(description=(
+        "Replay a Relay.Mesos trace through the Scheduler with a fake"
+        " driver and compare its decisions to the recorded ones"))
+    ap.add_argument('trace_file', help="A file written via --mesos_trace_file")
+    ap.add_argument('--speed', type=float, default=0, help=(
+        "Replay this many times faster than real time."
+        "  By default, replay as fast as possible"))
+    return ap
+
+
+def main(ns):
+    stats = replay(ns.trace_file, speed=ns.speed)
+    log.info('Replayed trace', extra=dict(trace_file=ns.trace_file, **stats))
+    json.dump(stats, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(build_arg_parser().parse_args())
@@ -1,6 +1,12 @@
 from relay_mesos import log
 
 
+# Resource types supported by Mesos
+SCALAR_KEYS = {'cpus': float, 'mem': int, 'disk': int}
+RANGE_KEYS = {'ports': int}
+SET_KEYS = {'disks': str}
+
+
 def catch(func, exception_sender):
     """Closure that calls given func.  If an error is raised, send it somewhere
 
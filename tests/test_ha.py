@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+
+from mesos.interface import mesos_pb2
+
+from relay_mesos.ha import FileLockElection
+from relay_mesos.main import build_arg_parser
+from relay_mesos.scheduler import Scheduler
+from relay_mesos.trace import _ReplayMV
+
+
+def _ns(*args):
+    return build_arg_parser().parse_args([
+        '--mesos_master', 'zk://localhost', '--warmer', 'echo warm'] +
+        list(args))
+
+
+class _Sender(object):
+    def send(self, exception):
+        raise exception
+
+
+class _Ready(object):
+    def set(self):
+        pass
+
+
+class _Counter(object):
+    value = 0
+
+
+class _Driver(object):
+    def __init__(self):
+        self.reconciled = []
+
+    def reconcileTasks(self, statuses):
+        self.reconciled.append(statuses)
+
+
+class TestFileLockElection(object):
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lock = os.path.join(self.tmpdir, 'lock')
+        self.ns = _ns('--mesos_ha_lock', self.lock)
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_only_one_leader(self):
+        a = FileLockElection(self.lock, self.ns)
+        b = FileLockElection(self.lock, self.ns)
+        assert a.try_acquire()
+        assert a.try_acquire()
+        assert not b.try_acquire()
+        os.close(a._fd)  # the leader dies
+        assert b.try_acquire()
+
+    def test_framework_id(self):
+        a = FileLockElection(self.lock, self.ns)
+        b = FileLockElection(self.lock, self.ns)
+        assert a.get_framework_id() is None
+        a.set_framework_id('fw1')
+        assert b.get_framework_id() == 'fw1'
+        b.clear_framework_id()
+        assert a.get_framework_id() is None
+        b.clear_framework_id()
+
+    def _scheduler(self, election, **kwargs):
+        return Scheduler(
+            MV=_ReplayMV([0, 0]), exception_sender=_Sender(),
+            mesos_ready=_Ready(), ns=self.ns, election=election, **kwargs)
+
+    def _register(self, scheduler, framework_id):
+        driver = _Driver()
+        scheduler.registered(
+            driver, mesos_pb2.FrameworkID(value=framework_id),
+            mesos_pb2.MasterInfo(id='m', ip=1, port=5050))
+        return driver
+
+    def test_new_framework_is_stored(self):
+        election = FileLockElection(self.lock, self.ns)
+        driver = self._register(self._scheduler(election), 'fw1')
+        assert election.get_framework_id() == 'fw1'
+        assert driver.reconciled == []
+
+    def test_takeover_reconciles_tasks(self):
+        election = FileLockElection(self.lock, self.ns)
+        election.set_framework_id('fw1')
+        scheduler = self._scheduler(election, active_tasks=_Counter())
+        driver = self._register(scheduler, 'fw1')
+        assert driver.reconciled == [[]]
+
+        update = mesos_pb2.TaskStatus(
+            state=mesos_pb2.TASK_RUNNING,
+            reason=mesos_pb2.TaskStatus.REASON_RECONCILIATION)
+        update.task_id.value = '0.o1.123.x3'
+        scheduler.statusUpdate(driver, update)
+        assert scheduler.active_tasks.value == 3
+
+    def test_refused_registration_forgets_framework_id(self):
+        election = FileLockElection(self.lock, self.ns)
+        election.set_framework_id('fw1')
+        self._scheduler(election).error(_Driver(), 'Framework removed')
+        assert election.get_framework_id() is None
+
+    def test_later_errors_keep_framework_id(self):
+        election = FileLockElection(self.lock, self.ns)
+        election.set_framework_id('fw1')
+        scheduler = self._scheduler(election)
+        self._register(scheduler, 'fw1')
+        scheduler.error(_Driver(), 'boom')
+        assert election.get_framework_id() == 'fw1'
+
+
+def test_reconciled_tasks_await_health():
+    now = [100]
+    ns = _ns('--mesos_health_check_command', 'true',
+             '--mesos_health_check_deadline', '60',
+             '--mesos_max_launching_per_agent', '5')
+    scheduler = Scheduler(
+        MV=_ReplayMV([0, 0]), exception_sender=_Sender(), mesos_ready=None,
+        ns=ns, active_tasks=_Counter(), clock=lambda: now[0])
+    update = mesos_pb2.TaskStatus(
+        state=mesos_pb2.TASK_RUNNING,
+        reason=mesos_pb2.TaskStatus.REASON_RECONCILIATION)
+    update.task_id.value = '0.o1.123'
+    update.slave_id.value = 's1'
+    scheduler.statusUpdate(_Driver(), update)
+    assert scheduler.awaiting_health == {'0.o1.123': 100}
+    assert scheduler.active_tasks.value == 0
+    assert scheduler.pacer.launching_per_agent == {'s1': 1}
+
+    update.healthy = True
+    update.ClearField('reason')
+    scheduler.statusUpdate(_Driver(), update)
+    assert scheduler.awaiting_health == {}
+    assert scheduler.active_tasks.value == 1
+    assert scheduler.pacer.launching_per_agent == {}
@@ -0,0 +1,170 @@
+import argparse
+
+from mesos.interface import mesos_pb2
+
+from relay_mesos.pacing import LaunchPacer, TokenBucket, MIN_REFUSE_SECONDS
+from relay_mesos.main import build_arg_parser
+from relay_mesos.scheduler import Scheduler
+from relay_mesos.trace import FakeDriver, _ReplayMV
+
+
+class Clock(object):
+    def __init__(self, now=1000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _pacer_ns(rate=0, burst=0, ramp=0, max_per_agent=0):
+    return argparse.Namespace(
+        mesos_launch_rate=rate, mesos_launch_burst=burst,
+        mesos_launch_ramp=ramp, mesos_max_launching_per_agent=max_per_agent,
+        mesos_framework_name='framework')
+
+
+def _offer(oid, slave_id='s1', cpus=4):
+    offer = mesos_pb2.Offer()
+    offer.id.value = oid
+    offer.framework_id.value = 'f'
+    offer.slave_id.value = slave_id
+    offer.hostname = 'host-' + slave_id
+    res = offer.resources.add()
+    res.name = 'cpus'
+    res.type = mesos_pb2.Value.SCALAR
+    res.scalar.value = cpus
+    return offer
+
+
+def _task(tid, health_check=False):
+    task = mesos_pb2.TaskInfo(name=tid)
+    task.task_id.value = tid
+    task.slave_id.value = 's1'
+    if health_check:
+        task.health_check.command.value = 'true'
+    return task
+
+
+def _status(tid, state, healthy=None):
+    update = mesos_pb2.TaskStatus(state=state)
+    update.task_id.value = tid
+    if healthy is not None:
+        update.healthy = healthy
+    return update
+
+
+def test_token_bucket_refills_at_rate():
+    clock = Clock()
+    bucket = TokenBucket(2, 4, clock=clock)
+    assert bucket.available() == 4
+    bucket.take(4)
+    assert bucket.available() == 0
+    assert bucket.retry_after() == 0.5
+    clock.now += 1
+    assert bucket.available() == 2
+    clock.now += 100
+    assert bucket.available() == 4
+
+
+def test_token_bucket_ramp():
+    clock = Clock()
+    bucket = TokenBucket(10, 10, ramp=2, clock=clock)
+    # a burst after idling starts with one launch
+    assert bucket.available() == 1
+    bucket.take(1)
+    assert bucket.available() == 0
+    # then the rate grows linearly to 10/s over 2 seconds
+    clock.now += 1
+    assert bucket.available() == 5
+    bucket.take(5)
+    clock.now += 1
+    assert bucket.available() == 10
+    # after idling for longer than the ramp, the next burst ramps again
+    clock.now += 10
+    assert bucket.available() == 1
+
+
+def test_pace_unlimited():
+    pacer = LaunchPacer(_pacer_ns())
+    offers = [(_offer('o1'), 3), (_offer('o2', 's2'), 2)]
+    assert pacer.pace(offers) == (offers, [])
+    assert pacer.retry_after() == MIN_REFUSE_SECONDS
+
+
+def test_pace_with_launch_rate():
+    clock = Clock()
+    pacer = LaunchPacer(_pacer_ns(rate=1, burst=4), clock=clock)
+    o1, o2, o3 = _offer('o1'), _offer('o2', 's2'), _offer('o3', 's3')
+    paced, held = pacer.pace([(o1, 3), (o2, 3), (o3, 3)])
+    assert paced == [(o1, 3), (o2, 1)]
+    assert held == [o3]
+    pacer.launched(o1, [_task('a')], [3])
+    pacer.launched(o2, [_task('b')], [1])
+    assert pacer.retry_after() == 1
+    clock.now += 2
+    assert pacer.pace([(o3, 3)]) == ([(o3, 2)], [])
+
+
+def test_pace_max_launching_per_agent():
+    pacer = LaunchPacer(_pacer_ns(max_per_agent=2))
+    o1, o2 = _offer('o1'), _offer('o2', 's2')
+    pacer.launched(o1, [_task('a'), _task('b', health_check=True)], [1, 1])
+    assert pacer.launching_per_agent == {'s1': 2}
+    assert pacer.pace([(o1, 3), (o2, 3)]) == ([(o2, 2)], [o1])
+
+    # staging and starting tasks are still launching
+    pacer.status_update(_status('a', mesos_pb2.TASK_STARTING))
+    assert pacer.launching_per_agent == {'s1': 2}
+    pacer.status_update(_status('a', mesos_pb2.TASK_RUNNING))
+    assert pacer.launching_per_agent == {'s1': 1}
+    # tasks with a health check are launching until healthy
+    pacer.status_update(_status('b', mesos_pb2.TASK_RUNNING))
+    pacer.status_update(_status('b', mesos_pb2.TASK_RUNNING, healthy=False))
+    assert pacer.launching_per_agent == {'s1': 1}
+    pacer.status_update(_status('b', mesos_pb2.TASK_RUNNING, healthy=True))
+    assert pacer.launching_per_agent == {}
+    assert pacer.launching == {}
+
+
+def test_pace_counts_replicas():
+    pacer = LaunchPacer(_pacer_ns(max_per_agent=4))
+    o1 = _offer('o1')
+    pacer.launched(o1, [_task('a.x3')], [3])
+    assert pacer.pace([(o1, 3)]) == ([(o1, 1)], [])
+    pacer.status_update(_status('a.x3', mesos_pb2.TASK_FAILED))
+    assert pacer.launching_per_agent == {}
+
+
+class _Sender(object):
+    def send(self, exception):
+        raise exception
+
+
+def _scheduler(MV, *args):
+    ns = build_arg_parser().parse_args([
+        '--mesos_master', 'zk://localhost', '--warmer', 'echo warm',
+        '--mesos_task_resources', 'cpus=1'] + list(args))
+    return Scheduler(
+        MV=MV, exception_sender=_Sender(), mesos_ready=None, ns=ns,
+        clock=Clock())
+
+
+def test_held_back_tasks_stay_requested():
+    MV = _ReplayMV([20, 1])
+    scheduler = _scheduler(
+        MV, '--mesos_launch_rate', '1', '--mesos_launch_burst', '5')
+    driver = FakeDriver()
+    scheduler.resourceOffers(
+        driver, [_offer('o1', cpus=4), _offer('o2', 's2')])
+    assert sum(driver.launched.values()) == 5
+    # the offers could fit 8 tasks.  The pacer held back 3.
+    assert MV[0] == 3
+
+
+def test_unpaced_request_is_claimed():
+    MV = _ReplayMV([20, 1])
+    scheduler = _scheduler(MV)
+    driver = FakeDriver()
+    scheduler.resourceOffers(driver, [_offer('o1', cpus=4)])
+    assert sum(driver.launched.values()) == 4
+    assert MV[0] == 0
@@ -0,0 +1,137 @@
+import subprocess
+
+from mesos.interface import mesos_pb2
+
+from relay_mesos import scheduler
+from relay_mesos.main import build_arg_parser
+from relay_mesos.trace import FakeDriver, _ReplayMV
+
+
+def _ns(*args):
+    return build_arg_parser().parse_args([
+        '--mesos_master', 'zk://localhost', '--warmer', 'echo warm',
+        '--cooler', 'echo cool'] + list(args))
+
+
+def _offer(oid, slave_id='s1', role='*', **scalars):
+    offer = mesos_pb2.Offer()
+    offer.id.value = oid
+    offer.framework_id.value = 'f'
+    offer.slave_id.value = slave_id
+    offer.hostname = 'host-' + slave_id
+    for name, value in sorted(scalars.items()):
+        res = offer.resources.add()
+        res.name = name
+        res.role = role
+        res.type = mesos_pb2.Value.SCALAR
+        res.scalar.value = value
+    return offer
+
+
+def _scalars(resources):
+    return {(r.name, r.role): r.scalar.value for r in resources}
+
+
+class _Sender(object):
+    def send(self, exception):
+        raise exception
+
+
+def test_group_replicas():
+    assert scheduler.group_replicas(0, 4) == []
+    assert scheduler.group_replicas(3, 1) == [1, 1, 1]
+    assert scheduler.group_replicas(4, 4) == [4]
+    assert scheduler.group_replicas(5, 4) == [3, 2]
+    assert scheduler.group_replicas(10, 4) == [4, 3, 3]
+
+
+def test_group_replicas_never_exceeds_fanout():
+    for nreplicas in range(50):
+        for fanout in range(1, 8):
+            grouped = scheduler.group_replicas(nreplicas, fanout)
+            assert sum(grouped) == nreplicas
+            assert all(0 < n <= fanout for n in grouped)
+
+
+def test_task_replicas():
+    assert scheduler.task_replicas('0.o1.1234') == 1
+    assert scheduler.task_replicas('0.o1.1234.x3') == 3
+    assert scheduler.task_replicas('0.o1.x.1234') == 1
+    assert scheduler.task_replicas('task') == 1
+
+
+def test_fanout_command():
+    command = scheduler._fanout_command('echo $RELAY_MESOS_REPLICA', 3)
+    out = subprocess.check_output(['bash', '-c', command])
+    assert sorted(out.split()) == ['0', '1', '2']
+    command = scheduler._fanout_command('test $RELAY_MESOS_REPLICA != 1', 3)
+    assert subprocess.call(['bash', '-c', command]) == 1
+
+
+def test_sum_resources():
+    resources = scheduler._sum_resources([
+        _offer('o1', cpus=1, mem=10), _offer('o2', cpus=0.5),
+        _offer('o3', role='web', cpus=2)])
+    assert _scalars(resources) == {
+        ('cpus', '*'): 1.5, ('mem', '*'): 10, ('cpus', 'web'): 2}
+
+
+def test_sum_resources_leaves_offers_alone():
+    offer = _offer('o1', cpus=1)
+    scheduler._sum_resources([offer, _offer('o2', cpus=1)])
+    assert offer.resources[0].scalar.value == 1
+
+
+def test_group_offers_by_agent():
+    agents = scheduler.group_offers_by_agent([
+        _offer('o1', 'b', cpus=1), _offer('o2', 'a', cpus=1),
+        _offer('o3', 'b', cpus=2)])
+    assert [x.slave_id.value for x in agents] == ['b', 'a']
+    assert [x.value for x in agents[0].ids] == ['o1', 'o3']
+    assert agents[0].hostname == 'host-b'
+    assert _scalars(agents[0].resources) == {('cpus', '*'): 3}
+    assert scheduler.calc_tasks_per_offer(agents[0], {'cpus': 1.5}) == 2
+
+
+def test_partial_offers_are_combined_across_callbacks():
+    ns = _ns('--mesos_task_resources', 'cpus=2',
+             '--mesos_offer_hoard_seconds', '10')
+    MV = _ReplayMV([1, 1])
+    s = scheduler.Scheduler(
+        MV=MV, exception_sender=_Sender(), mesos_ready=None, ns=ns,
+        clock=lambda: 100)
+    driver = FakeDriver()
+    s.resourceOffers(driver, [_offer('o1', 'a', cpus=1)])
+    assert driver.launched == {} and driver.declined == []
+    driver = FakeDriver()
+    s.resourceOffers(driver, [_offer('o2', 'a', cpus=1)])
+    assert driver.launched == {('o1', 'o2'): 1}
+
+
+def test_hoarded_offers_expire():
+    now = [100]
+    ns = _ns('--mesos_task_resources', 'cpus=2',
+             '--mesos_offer_hoard_seconds', '10')
+    s = scheduler.Scheduler(
+        MV=_ReplayMV([1, 1]), exception_sender=_Sender(), mesos_ready=None,
+        ns=ns, clock=lambda: now[0])
+    s.resourceOffers(FakeDriver(), [_offer('o1', 'a', cpus=1)])
+    now[0] = 111
+    driver = FakeDriver()
+    update = mesos_pb2.TaskStatus(state=mesos_pb2.TASK_RUNNING)
+    update.task_id.value = 't'
+    s.statusUpdate(driver, update)
+    assert driver.declined == ['o1']
+    assert s.hoarded_offers == {}
+
+
+def test_offers_are_not_hoarded_without_demand():
+    ns = _ns('--mesos_task_resources', 'cpus=2',
+             '--mesos_offer_hoard_seconds', '10')
+    s = scheduler.Scheduler(
+        MV=_ReplayMV([0, 1]), exception_sender=_Sender(), mesos_ready=None,
+        ns=ns)
+    driver = FakeDriver()
+    s.resourceOffers(driver, [_offer('o1', 'a', cpus=1)])
+    assert driver.declined == ['o1']
+    assert s.hoarded_offers == {}
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+
+from mesos.interface import mesos_pb2
+
+from relay_mesos import trace
+from relay_mesos.main import build_arg_parser
+from relay_mesos.scheduler import Scheduler
+
+
+def _ns(*args):
+    return build_arg_parser().parse_args([
+        '--mesos_master', 'zk://localhost', '--warmer', 'echo warm',
+        '--cooler', 'echo cool'] + list(args))
+
+
+def _offer(oid, slave_id='s1', cpus=4, mem=100):
+    offer = mesos_pb2.Offer()
+    offer.id.value = oid
+    offer.framework_id.value = 'f'
+    offer.slave_id.value = slave_id
+    offer.hostname = 'host-' + slave_id
+    for name, value in [('cpus', cpus), ('mem', mem)]:
+        res = offer.resources.add()
+        res.name = name
+        res.type = mesos_pb2.Value.SCALAR
+        res.scalar.value = value
+    return offer
+
+
+def _status(tid, state):
+    update = mesos_pb2.TaskStatus()
+    update.task_id.value = tid
+    update.state = state
+    return update
+
+
+class _Sender(object):
+    def send(self, exception):
+        raise exception
+
+
+class TestTrace(object):
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'trace')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_what_was_written(self):
+        rec = trace.TraceRecorder(self.path, _ns())
+        offer = _offer('o1')
+        task = mesos_pb2.TaskInfo(name='t')
+        task.task_id.value = 't1'
+        task.slave_id.value = 's1'
+        rec.offers([offer])
+        rec.mv(3, 10.5)
+        rec.launch(offer.id, [task])
+        rec.decline(offer.id)
+        rec.status(_status('t1', mesos_pb2.TASK_RUNNING))
+        rec.revive()
+        rec.kill(task.task_id)
+        rec.rescind(offer.id)
+        rec.flush()
+
+        header, events = trace.read_trace(self.path)
+        assert header['ns']['mesos_framework_name'] == 'framework'
+        kinds = [kind for kind, _, _ in events]
+        assert kinds == [
+            trace.OFFERS, trace.MV, trace.LAUNCH, trace.DECLINE,
+            trace.STATUS, trace.REVIVE, trace.KILL, trace.RESCIND]
+        data = [x for _, _, x in events]
+        assert data[0] == [offer]
+        assert data[1] == (3, 10.5)
+        assert data[2] == ([offer.id], [task])
+        assert data[3] == offer.id
+        assert data[4].task_id.value == 't1'
+        assert data[5] is None
+        assert data[6] == task.task_id
+        assert data[7] == offer.id
+
+    def test_secrets_are_not_recorded(self):
+        env_path = os.path.join(self.tmpdir, 'env')
+        with open(env_path, 'w') as fp:
+            fp.write('TOKEN=hunter2\n')
+        ns = _ns(
+            '--mesos_environment', env_path,
+            '--docker_image', 'img',
+            '--docker_parameters', '{"env": "PASSWORD=hunter2"}',
+            '--mesos_task_resources', 'cpus=1,mem=1')
+        rec = trace.TraceRecorder(self.path, ns)
+        MV = trace._ReplayMV([2, 1])
+        scheduler = Scheduler(
+            MV=MV, exception_sender=_Sender(), mesos_ready=None, ns=ns,
+            trace=rec)
+        scheduler.resourceOffers(trace.FakeDriver(), [_offer('o1')])
+        rec.flush()
+        with open(self.path, 'rb') as fp:
+            assert 'hunter2' not in fp.read()
+        header, _ = trace.read_trace(self.path)
+        assert header['ns']['warmer'] is True
+        assert 'mesos_environment' not in header['ns']
+
+    def test_replay_matches_recording(self):
+        ns = _ns('--mesos_task_resources', 'cpus=1,mem=1')
+        rec = trace.TraceRecorder(self.path, ns)
+        MV = trace._ReplayMV([5, 1])
+        scheduler = Scheduler(
+            MV=MV, exception_sender=_Sender(), mesos_ready=None, ns=ns,
+            trace=rec)
+        scheduler.resourceOffers(trace.FakeDriver(), [
+            _offer('o1', 's1', cpus=2), _offer('o2', 's2', cpus=0.5),
+            _offer('o3', 's3', cpus=8)])
+        scheduler.statusUpdate(
+            trace.FakeDriver(), _status('x', mesos_pb2.TASK_RUNNING))
+        rec.flush()
+
+        stats = trace.replay(self.path)
+        assert stats['offer_callbacks'] == 1
+        assert stats['status_updates'] == 1
+        assert stats['recorded_tasks_launched'] == 5
+        assert stats['replayed_tasks_launched'] == 5
+        assert stats['mismatched_callbacks'] == 0
+
+    def test_replay_finishes_after_max_failures(self):
+        ns = _ns('--max_failures', '2')
+        rec = trace.TraceRecorder(self.path, ns)
+        for tid in ['t1', 't2', 't3']:
+            rec.status(_status(tid, mesos_pb2.TASK_FAILED))
+        rec.flush()
+
+        stats = trace.replay(self.path)
+        assert stats['status_updates'] == 3